@@ -8,15 +8,25 @@ import json
 import tempfile
 import traceback
 import time
+import threading
+import queue
+from dataclasses import dataclass, fields, asdict
 from datetime import datetime
 import sys
 
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
 # --- Directories and configuration ---
 SAVE_DIR = "snapshots"
 SETTINGS_DIR = "settings"
 DEBUG_DIR = "debug"
 DEBUG_FILE = os.path.join(DEBUG_DIR, "error.log")
 SETTINGS_FILE = os.path.join(SETTINGS_DIR, "config.json")
+SESSION_PREFIX = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")  # snapshot/video names: <kind>_<session>_<counter>
 
 os.makedirs(SAVE_DIR, exist_ok=True)
 os.makedirs(SETTINGS_DIR, exist_ok=True)
@@ -68,49 +78,90 @@ def backup_file(path):
     except Exception as e:
         log_exception(e, "backup_file")
 
+SETTINGS_COMMENTS = {
+    "_comment_1": "------------ GOYOJO GW192A CAMERA INDEX ---------------------",
+    "_comment_2": "",
+    "_comment_WINDOWS_SYSTEM": "For Windows use numeric index (e.g., 0, 1, 2). Example: 'gw192a_camera_index': 1 will open the second camera detected by the system.",
+    "_comment_3": "",
+    "_comment_LINUX_SYSTEM": "For Linux/Raspberry Pi use device path instead (e.g., '/dev/video0', '/dev/video1', '/dev/v4l/by-id/usb-GW192A_Thermal_Camera-video-index0').",
+    "_comment_4": "",
+    "_comment_5": "-------------------------------------------------------------",
+}
+
+@dataclass(slots=True)
+class Settings:
+    """Persisted user settings, stored in SETTINGS_FILE together with SETTINGS_COMMENTS."""
+    gw192a_camera_index: int | str = 1
+    rotation_index: int = 1
+    map_index: int = 0
+    interpolation_index: int = 1  # cv2.INTER_NEAREST
+    scale_percent: int = 650
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build Settings from parsed JSON. Returns (settings, changed); changed is True if a field was missing or invalid."""
+        values = {}
+        changed = False
+        for field in fields(cls):
+            value = data.get(field.name)
+            if isinstance(value, field.type):
+                values[field.name] = value
+            else:
+                changed = True
+        return cls(**values), changed
+
+    def to_dict(self):
+        return {**SETTINGS_COMMENTS, **asdict(self)}
+
 def load_settings():
     """Load settings or create defaults if missing/corrupted."""
-    default_settings = {
-        "_comment_1": "------------ GOYOJO GW192A CAMERA INDEX ---------------------",
-        "_comment_2": "",
-        "_comment_WINDOWS_SYSTEM": "For Windows use numeric index (e.g., 0, 1, 2). Example: 'gw192a_camera_index': 1 will open the second camera detected by the system.",
-        "_comment_3": "",
-        "_comment_LINUX_SYSTEM": "For Linux/Raspberry Pi use device path instead (e.g., '/dev/video0', '/dev/video1', '/dev/v4l/by-id/usb-GW192A_Thermal_Camera-video-index0').",
-        "_comment_4": "",
-        "_comment_5": "-------------------------------------------------------------",
-        "gw192a_camera_index": 1,
-        "rotation_index": 1,
-        "map_index": 0,
-        "interpolation_index": 0,
-        "scale_percent": 650
-    }
-
     if not os.path.exists(SETTINGS_FILE):
-        atomic_save_json(SETTINGS_FILE, default_settings)
-        return default_settings
+        settings = Settings()
+        atomic_save_json(SETTINGS_FILE, settings.to_dict())
+        return settings
 
     try:
         with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
-        changed = False
-        for k, v in default_settings.items():
-            if k not in data or not isinstance(data[k], type(v)):
-                data[k] = v
-                changed = True
+        settings, changed = Settings.from_dict(data)
         if changed:
             backup_file(SETTINGS_FILE)
-            atomic_save_json(SETTINGS_FILE, data)
-        return data
+            atomic_save_json(SETTINGS_FILE, settings.to_dict())
+        return settings
     except Exception as e:
         log_exception(e, "load_settings")
         backup_file(SETTINGS_FILE)
-        atomic_save_json(SETTINGS_FILE, default_settings)
-        return default_settings
-
-def update_and_save(settings, key, value):
-    """Update settings dict and save to disk."""
-    settings[key] = value
-    success = atomic_save_json(SETTINGS_FILE, settings)
+        settings = Settings()
+        atomic_save_json(SETTINGS_FILE, settings.to_dict())
+        return settings
+
+_settings_dirty = False
+_settings_first_change = 0
+_settings_last_change = 0
+SETTINGS_SAVE_DELAY = 0.5  # seconds of quiet before saving
+SETTINGS_MAX_DELAY = 2.0  # seconds; save at least this often while changes keep coming
+
+def schedule_save():
+    """Mark settings as changed; flush_settings() writes them to disk later."""
+    global _settings_dirty, _settings_first_change, _settings_last_change
+    now = time.monotonic()
+    if not _settings_dirty:
+        _settings_first_change = now
+    _settings_dirty = True
+    _settings_last_change = now
+
+def flush_settings(settings, force=False, now=None):
+    """Save pending settings after SETTINGS_SAVE_DELAY of quiet, SETTINGS_MAX_DELAY at the latest, or immediately if force."""
+    global _settings_dirty
+    if not _settings_dirty:
+        return True
+    if now is None:
+        now = time.monotonic()
+    if (not force and now - _settings_last_change <= SETTINGS_SAVE_DELAY
+            and now - _settings_first_change <= SETTINGS_MAX_DELAY):
+        return True
+    _settings_dirty = False
+    success = atomic_save_json(SETTINGS_FILE, settings.to_dict())
     if not success:
         log_error("Warning: Failed to save settings to disk.")
     return success
@@ -123,32 +174,37 @@ MESSAGE_DURATION = 2.0  # seconds
 def show_message(text):
     global last_message, last_message_time
     last_message = text
-    last_message_time = time.time()
-
-# --- Recording state ---
-is_recording = False
-video_writer = None
-video_filename = None
-rec_blink_state = False
-last_blink_time = 0
-BLINK_INTERVAL = 1  # seconds
+    last_message_time = time.monotonic()
 
-# --- Load persisted settings ---
-settings = load_settings()
-camera_source = settings.get("gw192a_camera_index", 1)
-rotation_index = int(settings.get("rotation_index", 1))
-map_index = int(settings.get("map_index", 0))
-interpolation_index = int(settings.get("interpolation_index", 0))
-scale_percent = int(settings.get("scale_percent", 600))
+# --- Recording indicator ---
+BLINK_INTERVAL = 1  # seconds
+REC_COLOR = (0, 0, 255)
+REC_FONT_SCALE = 1
+REC_THICKNESS = 3
 
 # --- Parameters ---
 min_scale, max_scale, step = 150, 1000, 50
-show_text = False
 cameraResolution_Horizontal = 96
 cameraResolution_Vertical = 96
 
+# --- OpenCL (transparent API) resize and colormap, used only where the upscale dominates ---
+OPENCL_MIN_SCALE = 800  # below this the upload/download overhead outweighs the gain
+use_opencl = False
+try:
+    use_opencl = cv2.ocl.haveOpenCL()
+    cv2.ocl.setUseOpenCL(use_opencl)
+except Exception as e:
+    log_exception(e, "OpenCL check")
+
+# --- CUDA resize and colormap (optional, needs an OpenCV build with CUDA) ---
+CUDA_INTERPS = (cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC)  # supported by cv2.cuda.resize
+use_cuda = False
+try:
+    use_cuda = cv2.cuda.getCudaEnabledDeviceCount() > 0
+except (AttributeError, cv2.error):
+    pass
+
 # --- Gradient overlay settings ---
-show_gradient = True
 gradient_width = 20
 gradient_margin = 10
 
@@ -176,21 +232,172 @@ interpolation_type = [
     cv2.INTER_BITS2, cv2.INTER_CUBIC, cv2.INTER_LANCZOS4, cv2.INTER_LINEAR
 ]
 
-# Defensive bounds
-rotation_index %= len(rotation_modes)
-map_index %= len(color_maps)
-interpolation_index %= len(interpolation_type)
-scale_percent = max(min(scale_percent, max_scale), min_scale)
+# --- Color palette LUTs ---
+def build_palettes():
+    """Return a (len(color_maps), 256, 3) array holding the BGR lookup table of every color map."""
+    ramp = np.arange(256, dtype=np.uint8).reshape(256, 1)
+    palettes = np.empty((len(color_maps), 256, 3), dtype=np.uint8)
+    for i, cmap in enumerate(color_maps):
+        try:
+            palettes[i] = cv2.applyColorMap(ramp, cmap).reshape(256, 3)
+        except Exception as e:
+            log_exception(e, f"build_palettes (map {i})")
+            palettes[i] = cv2.applyColorMap(ramp, color_maps[0]).reshape(256, 3)
+    return palettes
+
+_palettes = build_palettes()
+
+# --- Fused kernels (optional, requires numba) ---
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def thermal_pipeline(frame_bgr, gray_out):
+        """Convert BGR to gray and min/max normalize it to 0..255 in two passes."""
+        h, w = gray_out.shape
+        lo = 255
+        hi = 0
+        # Pass 1: BGR -> gray (same fixed-point weights as cv2.COLOR_BGR2GRAY) and min/max
+        for y in prange(h):
+            for x in range(w):
+                v = (int(frame_bgr[y, x, 0]) * 1868 + int(frame_bgr[y, x, 1]) * 9617
+                     + int(frame_bgr[y, x, 2]) * 4899 + 8192) >> 14
+                gray_out[y, x] = v
+                lo = min(lo, v)
+                hi = max(hi, v)
+        rng = hi - lo
+        # Pass 2: normalize in place
+        for y in prange(h):
+            for x in range(w):
+                if rng > 0:
+                    gray_out[y, x] = ((int(gray_out[y, x]) - lo) * 510 + rng) // (2 * rng)
+                else:
+                    gray_out[y, x] = 0
+
+    @njit(parallel=True, cache=True)
+    def apply_palette(gray, lut, out_bgr):
+        """Write lut[gray] into out_bgr in one pass (no 3-channel index image)."""
+        h, w = gray.shape
+        for y in prange(h):
+            for x in range(w):
+                v = gray[y, x]
+                out_bgr[y, x, 0] = lut[v, 0]
+                out_bgr[y, x, 1] = lut[v, 1]
+                out_bgr[y, x, 2] = lut[v, 2]
 
 # --- Text constants ---
 FONT = cv2.FONT_HERSHEY_SIMPLEX
 FONT_SCALE = 0.4
 THICKNESS = 1
 TEXT_COLOR = (255, 255, 255)
+LINE_AA = cv2.LINE_AA
+LABEL_COLOR = (0, 255, 255)
+LABEL_OUTLINE_COLOR = (64, 64, 64)
+LINE_STEP = 15
+FOOTER_TEXT = 'GOYOJO GW192A Thermal Camera. Type [H] for help.'
+HELP_LINES = [
+    'Application features:',
+    ' ',
+    'Type [H] to show/hide help',
+    'Type [+]/[-] to resize window',
+    'Type [R] to rotate window',
+    'Type [P] to change the color palette',
+    'Type [G] to turn the color gradient bar on/off',
+    'Type [I] to change the interpolation type',
+    'Type [S] to save the screenshot as a PNG file',
+    'Type [V] to capture video as MP4 file',
+    'Type [Q] to close application'
+]
+
+# --- Pre-rendered text sprites ---
+def render_text_sprite(lines, line_step=LINE_STEP, pad=2, font_scale=FONT_SCALE, color=TEXT_COLOR, thickness=THICKNESS):
+    """Rasterize text lines once. Returns (sprite, mask, origin) where origin is the first baseline inside the sprite."""
+    sizes = [cv2.getTextSize(line, FONT, font_scale, thickness) for line in lines]
+    ascent = max(size[1] for size, _ in sizes)
+    descent = max(baseline for _, baseline in sizes)
+    width = max(size[0] for size, _ in sizes) + 2 * pad
+    height = ascent + descent + line_step * (len(lines) - 1) + 2 * pad
+    sprite = np.zeros((height, width, 3), dtype=np.uint8)
+    origin = (pad, pad + ascent)
+    for i, line in enumerate(lines):
+        cv2.putText(sprite, line, (origin[0], origin[1] + i * line_step),
+                    FONT, font_scale, color, thickness, cv2.LINE_AA)
+    mask = (sprite.max(axis=2) > 127)[:, :, np.newaxis]  # brightest channel, so saturated colours count too
+    return sprite, mask, origin
+
+def clip_rect(dst, x0, y0, w, h):
+    """Clip a w x h rectangle at (x0, y0) to dst. Returns (dst_slices, src_slices) or None if fully outside."""
+    dx0, dy0 = max(x0, 0), max(y0, 0)
+    dx1, dy1 = min(x0 + w, dst.shape[1]), min(y0 + h, dst.shape[0])
+    if dx0 >= dx1 or dy0 >= dy1:
+        return None
+    sx0, sy0 = dx0 - x0, dy0 - y0
+    return ((slice(dy0, dy1), slice(dx0, dx1)),
+            (slice(sy0, sy0 + dy1 - dy0), slice(sx0, sx0 + dx1 - dx0)))
+
+def sprite_pixels(text_sprite, org, w, h):
+    """Return (ys, xs, colors) of the sprite's text pixels placed with its first baseline at org inside a w x h frame."""
+    sprite, mask, (ox, oy) = text_sprite
+    sy, sx = np.nonzero(mask[:, :, 0])
+    ys, xs = sy + (org[1] - oy), sx + (org[0] - ox)
+    keep = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+    return ys[keep], xs[keep], sprite[sy[keep], sx[keep]]
+
+OUTLINE_KERNEL = np.ones((3, 3), dtype=np.uint8)
+
+_label_cache = {}
+
+def get_label_masks(text, pad=2):
+    """Return (inner, outline, ascent) masks for text, rasterized and dilated once per string."""
+    masks = _label_cache.get(text)
+    if masks is None:
+        (tw, th), baseline = cv2.getTextSize(text, FONT, FONT_SCALE, THICKNESS)
+        canvas = np.zeros((th + baseline + 2 * pad, tw + 2 * pad), dtype=np.uint8)
+        cv2.putText(canvas, text, (pad, pad + th), FONT, FONT_SCALE, 255, THICKNESS, cv2.LINE_AA)
+        inner = canvas > 127
+        outline = (cv2.dilate(canvas, OUTLINE_KERNEL) > 127) & ~inner
+        masks = (inner, outline, pad + th)
+        _label_cache[text] = masks
+    return masks
+
+def draw_outlined_text(dst, text, org, color, outline_color, pad=2):
+    """Draw text with a 1 px outline from cached masks instead of 8 shifted putText calls."""
+    inner, outline, ascent = get_label_masks(text, pad)
+    rect = clip_rect(dst, org[0] - pad, org[1] - ascent, inner.shape[1], inner.shape[0])
+    if rect is None:
+        return
+    d, src = rect
+    roi = dst[d]
+    roi[outline[src]] = outline_color
+    roi[inner[src]] = color
+
+FOOTER_SPRITE = render_text_sprite([FOOTER_TEXT])
+HELP_SPRITE = render_text_sprite(HELP_LINES)
+REC_SPRITE = render_text_sprite(["REC"], font_scale=REC_FONT_SCALE, color=REC_COLOR, thickness=REC_THICKNESS)
+
+_overlay_cache = {}
+
+def get_static_overlay(w, h, show_text):
+    """Return the (ys, xs, colors) gather of the footer (and help panel) for a w x h frame, cached per key."""
+    key = (w, h, show_text)
+    overlay = _overlay_cache.get(key)
+    if overlay is None:
+        parts = [sprite_pixels(FOOTER_SPRITE, (10, h - 10), w, h)]
+        if show_text:
+            parts.append(sprite_pixels(HELP_SPRITE, (10, 20), w, h))
+        overlay = tuple(np.concatenate(arrays) for arrays in zip(*parts))
+        _overlay_cache[key] = overlay
+    return overlay
 
 # --- Initialize camera ---
-if isinstance(camera_source, str) and camera_source.isdigit():
-    camera_source = int(camera_source)
+def fourcc_to_str(code):
+    return "".join(chr((int(code) >> (8 * i)) & 0xFF) for i in range(4))
+
+def request_low_latency(stream):
+    """Ask the driver for a single-frame buffer and MJPG; log settings the backend did not accept."""
+    if not stream.set(cv2.CAP_PROP_BUFFERSIZE, 1) or stream.get(cv2.CAP_PROP_BUFFERSIZE) != 1:
+        log_error(f"Warning: CAP_PROP_BUFFERSIZE=1 not accepted (now {stream.get(cv2.CAP_PROP_BUFFERSIZE)}).")
+    mjpg = cv2.VideoWriter_fourcc(*'MJPG')
+    if not stream.set(cv2.CAP_PROP_FOURCC, mjpg) or int(stream.get(cv2.CAP_PROP_FOURCC)) != mjpg:
+        log_error(f"Warning: MJPG not accepted, using {fourcc_to_str(stream.get(cv2.CAP_PROP_FOURCC))!r}.")
 
 def open_camera(source, width, height):
     for attempt in range(3):
@@ -199,6 +406,8 @@ def open_camera(source, width, height):
                 stream = cv2.VideoCapture(source, cv2.CAP_DSHOW)
             else:
                 stream = cv2.VideoCapture(source)
+            if stream.isOpened():
+                request_low_latency(stream)
             stream.set(cv2.CAP_PROP_FRAME_WIDTH, width)
             stream.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
             if stream.isOpened():
@@ -210,243 +419,599 @@ def open_camera(source, width, height):
             log_exception(e, "open_camera")
     return None
 
-stream = open_camera(camera_source, cameraResolution_Horizontal, cameraResolution_Vertical)
-if not stream:
-    log_error("Camera could not be opened. Exiting.")
-    sys.exit(1)
+# --- Threaded frame capture ---
+STALE_GRAB_TIME = 0.005  # seconds; a grab() faster than this came from the driver queue
+MAX_STALE_GRABS = 4
+
+class FrameGrabber(threading.Thread):
+    """Read frames in the background and keep only the newest one in a single-slot queue."""
+
+    def __init__(self, stream):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.queue = queue.Queue(maxsize=1)
+        self.stopped = threading.Event()
+        # Drain queued driver frames ourselves when the backend ignored CAP_PROP_BUFFERSIZE=1
+        self.drain = stream.get(cv2.CAP_PROP_BUFFERSIZE) != 1
+
+    def read_latest(self):
+        """grab() until a call actually waits for the sensor, then decode only that frame."""
+        for _ in range(MAX_STALE_GRABS):
+            start = time.monotonic()
+            if not self.stream.grab():
+                return False, None
+            if not self.drain or time.monotonic() - start >= STALE_GRAB_TIME:
+                break
+        return self.stream.retrieve()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                ret, frame = self.read_latest()
+            except Exception as e:
+                log_exception(e, "FrameGrabber read")
+                ret, frame = False, None
+            if not ret or frame is None:
+                log_error("Stream read error.")
+                frame = None
+                self.stopped.set()
+            # Drop the stale frame so the consumer always gets the newest one
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put(frame)
+
+    def stop(self):
+        self.stopped.set()
+
+# --- Video codecs (first one that opens wins) ---
+VIDEO_FPS = 25
+VIDEO_CODECS = [  # (fourcc, container extension)
+    ('H264', '.mp4'),
+    ('X264', '.mp4'),
+    ('MJPG', '.avi'),
+    ('mp4v', '.mp4'),
+]
+
+def open_video_writer(base_path, fps, frame_size):
+    """Return (writer, filename, fourcc) for the first codec that opens, or (None, None, None)."""
+    params = []  # ask the backend for a hardware encoder where it supports one
+    if hasattr(cv2, "VIDEOWRITER_PROP_HW_ACCELERATION"):
+        params = [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    for fourcc, ext in VIDEO_CODECS:
+        filename = base_path + ext
+        try:
+            code = cv2.VideoWriter_fourcc(*fourcc)
+            if params:
+                writer = cv2.VideoWriter(filename, cv2.CAP_ANY, code, fps, frame_size, params)
+            else:
+                writer = cv2.VideoWriter(filename, code, fps, frame_size)
+            if writer.isOpened():
+                return writer, filename, fourcc
+            writer.release()
+        except Exception as e:
+            log_exception(e, f"open VideoWriter ({fourcc})")
+        if os.path.exists(filename) and os.path.getsize(filename) == 0:
+            os.remove(filename)
+    return None, None, None
+
+# --- Threaded video encoding ---
+class VideoWriterThread(threading.Thread):
+    """Encode frames on a background thread fed by a bounded queue (frames are dropped when it is full)."""
+
+    def __init__(self, writer, maxsize=4):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                self.writer.write(frame)
+            except Exception as e:
+                log_exception(e, "video_writer.write")
+
+    def write(self, frame):
+        try:
+            self.queue.put_nowait(frame.copy())
+        except queue.Full:
+            self.dropped += 1
+
+    def release(self):
+        self.queue.put(None)
+        self.join()
+        self.writer.release()
+        if self.dropped:
+            log_error(f"Recording dropped {self.dropped} frame(s).")
+
+# --- Threaded snapshot saving ---
+PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]  # fast encode, slightly larger files
+
+class SnapshotWriterThread(threading.Thread):
+    """Encode PNG snapshots on a background thread so [S] never blocks the preview."""
+
+    def __init__(self, maxsize=8):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            filename, image = item
+            try:
+                if not cv2.imwrite(filename, image, PNG_PARAMS):
+                    log_error(f"Failed to write snapshot: {filename}")
+            except Exception as e:
+                log_exception(e, "save snapshot")
+
+    def save(self, filename, image):
+        """Queue a copy of image for saving. Returns False if the queue is full."""
+        try:
+            self.queue.put_nowait((filename, image.copy()))
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
 
 # --- Gradient generation function ---
 def create_vertical_gradient(height):
     """Create a vertical grayscale gradient from 0 (black, bottom) to 255 (white, top)."""
-    gradient = np.linspace(0, 255, height, dtype=np.uint8)
-    gradient = np.flipud(gradient)
-    gradient = np.tile(gradient[:, np.newaxis], (1, gradient_width))
-    return gradient
+    gradient = np.linspace(255, 0, height, dtype=np.uint8)[:, np.newaxis]
+    return np.ascontiguousarray(np.broadcast_to(gradient, (height, gradient_width)))
+
+_grad_cache = {}
+
+def get_gradient_strip(map_index, grad_h):
+    """Return the colored gradient bar for (map_index, grad_h), building it only on a cache miss."""
+    key = (map_index, grad_h)
+    strip = _grad_cache.get(key)
+    if strip is None:
+        strip = _palettes[map_index][create_vertical_gradient(grad_h)]
+        _grad_cache[key] = strip
+    return strip
+
+# --- Output size ---
+def output_size(shape, scale_percent):
+    """Return the upscaled (width, height) for a source image of the given (h, w) shape."""
+    return max(1, shape[1] * scale_percent // 100), max(1, shape[0] * scale_percent // 100)
+
+# --- Cached nearest-neighbour upscale maps ---
+_resize_map_cache = {}
+
+def get_resize_maps(src_w, src_h, new_w, new_h, rotation_index=0):
+    """Return fixed-point remap tables equivalent to cv2.rotate + cv2.resize(INTER_NEAREST), built once per size."""
+    key = (src_w, src_h, new_w, new_h, rotation_index)
+    maps = _resize_map_cache.get(key)
+    if maps is None:
+        # Nearest source pixel in the rotated image, then back to unrotated source coordinates
+        rot_w, rot_h = (src_h, src_w) if rotation_index % 2 else (src_w, src_h)
+        rx = (np.arange(new_w) * rot_w // new_w).astype(np.float32)[np.newaxis, :]
+        ry = (np.arange(new_h) * rot_h // new_h).astype(np.float32)[:, np.newaxis]
+        if rotation_index == 1:    # 90 clockwise
+            mapx, mapy = ry, (src_h - 1) - rx
+        elif rotation_index == 2:  # 180
+            mapx, mapy = (src_w - 1) - rx, (src_h - 1) - ry
+        elif rotation_index == 3:  # 90 counterclockwise
+            mapx, mapy = (src_w - 1) - ry, rx
+        else:
+            mapx, mapy = rx, ry
+        mapx = np.ascontiguousarray(np.broadcast_to(mapx, (new_h, new_w)))
+        mapy = np.ascontiguousarray(np.broadcast_to(mapy, (new_h, new_w)))
+        maps = cv2.convertMaps(mapx, mapy, cv2.CV_16SC2, nninterpolation=True)
+        _resize_map_cache[key] = maps
+    return maps
+
+# --- Reusable working buffers ---
+def ensure_buffer(buf, shape, dtype=np.uint8):
+    """Return buf if it already has the requested shape and dtype, otherwise a new empty array."""
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        return np.empty(shape, dtype=dtype)
+    return buf
 
 # --- Mouse tracking variables ---
 mouse_x, mouse_y = 0, 0
-mouse_value = 0
 
 def mouse_callback(event, x, y, flags, param):
     global mouse_x, mouse_y
     if event == cv2.EVENT_MOUSEMOVE:
         mouse_x, mouse_y = x, y
 
-cv2.namedWindow("GW192A thermal Camera Live View")
-cv2.setMouseCallback("GW192A thermal Camera Live View", mouse_callback)
+WINDOW_NAME = "GW192A thermal Camera Live View"
 
-# --- Main loop ---
-try:
-    while True:
-        try:
-            ret, frame = stream.read()
-            if not ret or frame is None:
-                log_error("Stream read error.")
-                break
-
-            # --- Rotation ---
-            if rotation_modes[rotation_index] is not None:
-                frame = cv2.rotate(frame, rotation_modes[rotation_index])
+def create_window(name):
+    """Create the live view window, using an OpenGL texture when OpenCV was built with OpenGL support."""
+    try:
+        cv2.namedWindow(name, cv2.WINDOW_OPENGL | cv2.WINDOW_AUTOSIZE)
+        return True
+    except cv2.error:
+        cv2.namedWindow(name, cv2.WINDOW_AUTOSIZE)
+        return False
 
-            # --- Grayscale and normalize ---
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            gray_norm = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
-            gray_uint8 = np.uint8(gray_norm)
+# --- Main ---
+def main():
+    # --- Load persisted settings (with defensive bounds) ---
+    settings = load_settings()
+    camera_source = settings.gw192a_camera_index
+    if isinstance(camera_source, str) and camera_source.isdigit():
+        camera_source = int(camera_source)
+    rotation_index = settings.rotation_index % len(rotation_modes)
+    map_index = settings.map_index % len(color_maps)
+    interpolation_index = settings.interpolation_index % len(interpolation_type)
+    scale_percent = max(min(settings.scale_percent, max_scale), min_scale)
+    cur_rot = rotation_modes[rotation_index]
+    cur_interp = interpolation_type[interpolation_index]
+    palette_lut = _palettes[map_index].reshape(1, 256, 3)  # 1x256 3-channel layout for cv2.LUT
+
+    # --- CUDA buffers, allocated once; the palette LUT is re-uploaded only when it changes ---
+    if use_cuda:
+        gpu_gray, gpu_big, gpu_index, gpu_bgr = (cv2.cuda_GpuMat() for _ in range(4))
+        gpu_lut = cv2.cuda.createLookUpTable(palette_lut)
+
+    # --- View and recording state ---
+    show_text = False
+    show_gradient = True
+    is_recording = False
+    video_writer = None
+    video_filename = None
+    rec_blink_state = False
+    last_blink_time = 0
+    snapshot_counter = 0
+    video_counter = 0
+
+    # --- Output size (recomputed only when the scale or the source shape changes) ---
+    src_shape = None
+    new_w = new_h = 0
+    rec_overlay = None
+
+    # --- Reusable working buffers (reallocated only when the frame size changes) ---
+    rot_buf = gray_buf = gray_norm = gray_big_buf = index_bgr = clean_buf = disp_buf = None
+    clean_frame = None
+
+    stream = open_camera(camera_source, cameraResolution_Horizontal, cameraResolution_Vertical)
+    if not stream:
+        log_error("Camera could not be opened. Exiting.")
+        sys.exit(1)
+
+    grabber = FrameGrabber(stream)
+    grabber.start()
+    frame_queue = grabber.queue
+    snapshot_writer = SnapshotWriterThread()
+    snapshot_writer.start()
+
+    create_window(WINDOW_NAME)
+    cv2.setMouseCallback(WINDOW_NAME, mouse_callback)
+
+    def recompute_dim(shape):
+        nonlocal src_shape, new_w, new_h, rec_overlay
+        src_shape = shape
+        new_w, new_h = output_size(shape, scale_percent)
+        rec_overlay = sprite_pixels(REC_SPRITE, (new_w - 80, 40), new_w, new_h)
+
+    # --- Keyboard handlers (return True to leave the main loop) ---
+    def on_quit():
+        return True
 
-            # --- Apply colormap safely ---
+    def on_toggle_help():
+        nonlocal show_text
+        show_text = not show_text
+
+    def on_rotate():
+        nonlocal rotation_index, cur_rot
+        rotation_index = (rotation_index + 1) % 4
+        cur_rot = rotation_modes[rotation_index]
+        settings.rotation_index = rotation_index
+        schedule_save()
+        show_message(f"Rotate: {rotation_index * 90}°")
+
+    def on_next_palette():
+        nonlocal map_index, palette_lut, gpu_lut
+        map_index = (map_index + 1) % len(color_maps)
+        palette_lut = _palettes[map_index].reshape(1, 256, 3)
+        if use_cuda:
+            gpu_lut = cv2.cuda.createLookUpTable(palette_lut)
+        _grad_cache.clear()
+        settings.map_index = map_index
+        schedule_save()
+        show_message(f"Color palette: {map_index + 1} of {len(color_maps)}")
+
+    def on_next_interpolation():
+        nonlocal interpolation_index, cur_interp
+        interpolation_index = (interpolation_index + 1) % len(interpolation_type)
+        cur_interp = interpolation_type[interpolation_index]
+        settings.interpolation_index = interpolation_index
+        schedule_save()
+        show_message(f"Interpolation: {interpolation_index + 1} of {len(interpolation_type)}")
+
+    def change_scale(delta):
+        nonlocal scale_percent
+        if is_recording:
+            return
+        scale_percent = max(min(scale_percent + delta, max_scale), min_scale)
+        _grad_cache.clear()
+        _resize_map_cache.clear()
+        if src_shape is not None:
+            recompute_dim(src_shape)
+        settings.scale_percent = scale_percent
+        schedule_save()
+        show_message(f"Scale: {scale_percent}%")
+
+    def on_scale_up():
+        change_scale(step)
+
+    def on_scale_down():
+        change_scale(-step)
+
+    def on_snapshot():
+        nonlocal snapshot_counter
+        if clean_frame is None:
+            return
+        snapshot_counter += 1
+        filename = os.path.join(SAVE_DIR, f"snapshot_{SESSION_PREFIX}_{snapshot_counter:04d}.png")
+        if snapshot_writer.save(filename, clean_frame):
+            show_message(f"Saved: {os.path.basename(filename)}")
+        else:
+            log_error("Snapshot queue full, snapshot skipped.")
+            show_message("Failed to save snapshot.")
+
+    def on_toggle_recording():
+        nonlocal is_recording, video_writer, video_filename, rec_blink_state, last_blink_time, video_counter
+        if not is_recording:
+            if clean_frame is None:
+                return
+            video_counter += 1
+            base_path = os.path.join(SAVE_DIR, f"capture_{SESSION_PREFIX}_{video_counter:04d}")
+            frame_size = (clean_frame.shape[1], clean_frame.shape[0])
             try:
-                cmap = color_maps[map_index]
-                colored = cv2.applyColorMap(gray_uint8, cmap)
+                writer, video_filename, fourcc = open_video_writer(base_path, VIDEO_FPS, frame_size)
+                if writer is None:
+                    raise RuntimeError("VideoWriter failed to open.")
+                video_writer = VideoWriterThread(writer)
+                video_writer.start()
+                is_recording = True
+                rec_blink_state = True
+                last_blink_time = time.monotonic()
+                show_message(f"Recording started: {os.path.basename(video_filename)} ({fourcc})")
             except Exception as e:
-                log_exception(e, "applyColorMap")
-                map_index = 0
-                colored = cv2.applyColorMap(gray_uint8, color_maps[0])
-
-            # --- Resize safely ---
-            new_w = max(1, int(colored.shape[1] * scale_percent / 100))
-            new_h = max(1, int(colored.shape[0] * scale_percent / 100))
-            interp = interpolation_type[interpolation_index]
-            try:
-                clean_frame = cv2.resize(colored, (new_w, new_h), interpolation=interp)
-            except Exception as e:
-                log_exception(e, "resize")
-                clean_frame = cv2.resize(colored, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
-
-            # --- Overlay ---
-            display_frame = clean_frame.copy()
-            h, w = display_frame.shape[:2]
-
-            # --- Overlay gradient if enabled ---
-            if show_gradient:
-                grad_h = h - 2 * gradient_margin
-                grad_gray = create_vertical_gradient(grad_h)
+                log_exception(e, "start recording")
+                show_message("Failed to start recording.")
+                video_writer = None
+                is_recording = False
+        else:
+            is_recording = False
+            if video_writer is not None:
                 try:
-                    grad_colored = cv2.applyColorMap(grad_gray, color_maps[map_index])
+                    video_writer.release()
+                    show_message(f"Recording stopped: {os.path.basename(video_filename)}")
                 except Exception as e:
-                    log_exception(e, "applyColorMap to gradient")
-                    grad_colored = cv2.applyColorMap(grad_gray, color_maps[0])
-                grad_resized = cv2.resize(grad_colored, (gradient_width, grad_h), interpolation=cv2.INTER_NEAREST)
-                display_frame[gradient_margin:h-gradient_margin, w-gradient_width-gradient_margin:w-gradient_margin] = grad_resized
-
-            # --- Draw static text ---
-            cv2.putText(display_frame, 'GOYOJO GW192A Thermal Camera. Type [H] for help.',
-                        (10, h - 10), FONT, FONT_SCALE, TEXT_COLOR, THICKNESS, cv2.LINE_AA)
-
-            # --- Draw help text ---
-            if show_text:
-                lines = [
-                    'Application features:',
-                    ' ',
-                    'Type [H] to show/hide help',
-                    'Type [+]/[-] to resize window',
-                    'Type [R] to rotate window',
-                    'Type [P] to change the color palette',
-                    'Type [G] to turn the color gradient bar on/off',
-                    'Type [I] to change the interpolation type',
-                    'Type [S] to save the screenshot as a PNG file',
-                    'Type [V] to capture video as MP4 file',
-                    'Type [Q] to close application'
-                ]
-                y_line = 20
-                for line in lines:
-                    cv2.putText(display_frame, line, (10, y_line), FONT, FONT_SCALE, TEXT_COLOR, THICKNESS, cv2.LINE_AA)
-                    y_line += 15
-
-            # --- Draw last message ---
-            if last_message and (time.time() - last_message_time < MESSAGE_DURATION):
-                cv2.putText(display_frame, last_message, (10, h - 25), FONT, FONT_SCALE, TEXT_COLOR, THICKNESS, cv2.LINE_AA)
-
-            # --- Update mouse value scaled to original frame ---
-            orig_x = int(mouse_x / scale_percent * 100)
-            orig_y = int(mouse_y / scale_percent * 100)
-
-            # Defensive bounds
-            orig_x = min(max(orig_x, 0), gray_uint8.shape[1]-1)
-            orig_y = min(max(orig_y, 0), gray_uint8.shape[0]-1)
-
-            # Calculate grayscale value 0-100%
-            mouse_value = int(gray_uint8[orig_y, orig_x] / 255 * 100)
-
-           # --- Draw mouse value with full black outline (8-neighbor) ---
-            text = f"{mouse_value}%"
-            x = mouse_x + 5
-            y = mouse_y - 5
-
-            # Draw black outline around text (all 8 neighbours)
-            for dx in (-1, 0, 1):
-                for dy in (-1, 0, 1):
-                    if dx == 0 and dy == 0:
-                        continue
-                    cv2.putText(display_frame, text, (x + dx, y + dy),
-                                FONT, FONT_SCALE, (64, 64, 64), THICKNESS + 1, cv2.LINE_AA)
-
-            # Draw main green text
-            cv2.putText(display_frame, text, (x, y),
-                        FONT, FONT_SCALE, (0, 255, 255), THICKNESS, cv2.LINE_AA)
-
-            # --- Recording ---
-            if is_recording:
-                current_time = time.time()
-                if current_time - last_blink_time >= BLINK_INTERVAL:
-                    rec_blink_state = not rec_blink_state
-                    last_blink_time = current_time
-                if rec_blink_state:
-                    cv2.putText(display_frame, "REC", (w - 80, 40),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3, cv2.LINE_AA)
-                if video_writer is not None:
-                    try:
-                        video_writer.write(clean_frame)
-                    except Exception as e:
-                        log_exception(e, "video_writer.write")
-
-            # --- Show window ---
-            cv2.imshow("GW192A thermal Camera Live View", display_frame)
-
-            # --- Keyboard controls ---
-            key = cv2.waitKey(10) & 0xFF
-            if key == ord('q'):
-                break
-            elif key in (ord('h'), ord('H')):
-                show_text = not show_text
-            elif key in (ord('r'), ord('R')):
-                rotation_index = (rotation_index + 1) % 4
-                update_and_save(settings, "rotation_index", rotation_index)
-                show_message(f"Rotate: {rotation_index * 90}°")
-            elif key in (ord('p'), ord('P')):
-                map_index = (map_index + 1) % len(color_maps)
-                update_and_save(settings, "map_index", map_index)
-                show_message(f"Color palette: {map_index + 1} of {len(color_maps)}")
-            elif key in (ord('i'), ord('I')):
-                interpolation_index = (interpolation_index + 1) % len(interpolation_type)
-                update_and_save(settings, "interpolation_index", interpolation_index)
-                show_message(f"Interpolation: {interpolation_index + 1} of {len(interpolation_type)}")
-            elif key in (ord('+'), ord('=')) and not is_recording:
-                scale_percent = min(scale_percent + step, max_scale)
-                update_and_save(settings, "scale_percent", scale_percent)
-                show_message(f"Scale: {scale_percent}%")
-            elif key in (ord('-'), ord('_')) and not is_recording:
-                scale_percent = max(scale_percent - step, min_scale)
-                update_and_save(settings, "scale_percent", scale_percent)
-                show_message(f"Scale: {scale_percent}%")
-            elif key in (ord('s'), ord('S')):
-                timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                filename = os.path.join(SAVE_DIR, f"snapshot_{timestamp}.png")
+                    log_exception(e, "stop recording")
+                    show_message("Failed to stop recording.")
+                finally:
+                    video_writer = None
+
+    def on_toggle_gradient():
+        nonlocal show_gradient
+        show_gradient = not show_gradient
+
+    keymap = {}
+    for chars, handler in (
+        ('qQ', on_quit),
+        ('hH', on_toggle_help),
+        ('rR', on_rotate),
+        ('pP', on_next_palette),
+        ('iI', on_next_interpolation),
+        ('+=', on_scale_up),
+        ('-_', on_scale_down),
+        ('sS', on_snapshot),
+        ('vV', on_toggle_recording),
+        ('gG', on_toggle_gradient),
+    ):
+        for ch in chars:
+            keymap[ord(ch)] = handler
+
+    # Hot-loop names bound as locals
+    put_text = cv2.putText
+    monotonic = time.monotonic
+
+    # --- Main loop ---
+    try:
+        while True:
+            try:
+                try:
+                    frame = frame_queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                if frame is None:
+                    break
+                now = monotonic()
+
+                if frame.ndim == 2:
+                    # --- Single-channel source (e.g. raw Y16): normalize directly ---
+                    gray_norm = ensure_buffer(gray_norm, frame.shape)
+                    cv2.normalize(frame, gray_norm, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+                elif HAVE_NUMBA and frame.dtype == np.uint8:
+                    # --- Grayscale and normalize in one fused kernel ---
+                    gray_norm = ensure_buffer(gray_norm, frame.shape[:2])
+                    thermal_pipeline(frame, gray_norm)
+                else:
+                    # --- Grayscale (at the source depth, no uint8 cast) and normalize ---
+                    gray_buf = ensure_buffer(gray_buf, frame.shape[:2], frame.dtype)
+                    gray_norm = ensure_buffer(gray_norm, frame.shape[:2])
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray_buf)
+                    cv2.normalize(gray_buf, gray_norm, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+                gray_uint8 = gray_norm
+
+                # --- Rotation (on the single-channel image) ---
+                if cur_rot is None or cur_rot == cv2.ROTATE_180:
+                    rot_shape = gray_uint8.shape
+                else:
+                    rot_shape = (gray_uint8.shape[1], gray_uint8.shape[0])
+                if rot_shape != src_shape:
+                    recompute_dim(rot_shape)
+                interp = cur_interp
+                # Fractional nearest-neighbour zoom folds the rotation into its remap tables (one pass)
+                fold_rotation = interp == cv2.INTER_NEAREST and scale_percent % 100 != 0
+                if cur_rot is not None and not fold_rotation:
+                    rot_buf = ensure_buffer(rot_buf, rot_shape)
+                    gray_uint8 = cv2.rotate(gray_uint8, cur_rot, dst=rot_buf)
+
+                # --- Resize the single-channel image safely ---
+                gray_big_buf = ensure_buffer(gray_big_buf, (new_h, new_w))
+                on_gpu = False
                 try:
-                    cv2.imwrite(filename, clean_frame)
-                    show_message(f"Saved: {os.path.basename(filename)}")
+                    if interp == cv2.INTER_NEAREST and scale_percent % 100 == 0:
+                        # Integer zoom: replicate each pixel into an s x s block without cv2.resize
+                        s_int = scale_percent // 100
+                        src_h, src_w = gray_uint8.shape
+                        np.copyto(gray_big_buf.reshape(src_h, s_int, src_w, s_int),
+                                  gray_uint8[:, np.newaxis, :, np.newaxis])
+                        gray_big = gray_big_buf
+                    elif interp == cv2.INTER_NEAREST:
+                        src_h, src_w = gray_uint8.shape
+                        mapxy, _ = get_resize_maps(src_w, src_h, new_w, new_h, rotation_index)
+                        gray_big = cv2.remap(gray_uint8, mapxy, None, cv2.INTER_NEAREST, dst=gray_big_buf)
+                    elif use_cuda and scale_percent >= OPENCL_MIN_SCALE and interp in CUDA_INTERPS:
+                        gpu_gray.upload(gray_uint8)
+                        cv2.cuda.resize(gpu_gray, (new_w, new_h), dst=gpu_big, interpolation=interp)
+                        gray_big = gpu_big
+                        on_gpu = True
+                    elif use_opencl and scale_percent >= OPENCL_MIN_SCALE:
+                        # Stays on the device until the colormap has been applied
+                        gray_big = cv2.resize(cv2.UMat(gray_uint8), (new_w, new_h), interpolation=interp)
+                    else:
+                        gray_big = cv2.resize(gray_uint8, (new_w, new_h), dst=gray_big_buf, interpolation=interp)
                 except Exception as e:
-                    log_exception(e, "save snapshot")
-                    show_message("Failed to save snapshot.")
-            elif key in (ord('v'), ord('V')):
-                if not is_recording:
-                    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                    video_filename = os.path.join(SAVE_DIR, f"capture_{timestamp}.mp4")
-                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                    fps = 25
-                    frame_size = (clean_frame.shape[1], clean_frame.shape[0])
-                    try:
-                        video_writer = cv2.VideoWriter(video_filename, fourcc, fps, frame_size)
-                        if not video_writer.isOpened():
-                            raise RuntimeError("VideoWriter failed to open.")
-                        is_recording = True
-                        rec_blink_state = True
-                        last_blink_time = time.time()
-                        show_message(f"Recording started: {os.path.basename(video_filename)}")
-                    except Exception as e:
-                        log_exception(e, "start recording")
-                        show_message("Failed to start recording.")
-                        video_writer = None
-                        is_recording = False
+                    log_exception(e, "resize")
+                    if fold_rotation and cur_rot is not None:
+                        gray_uint8 = cv2.rotate(gray_uint8, cur_rot)
+                    gray_big = cv2.resize(gray_uint8, (new_w, new_h), dst=gray_big_buf, interpolation=cv2.INTER_LINEAR)
+
+                # --- Apply colormap via palette LUT on the upscaled image ---
+                if on_gpu:
+                    # CUDA: expand and colour on the device, then download into the reusable buffer
+                    clean_buf = ensure_buffer(clean_buf, (new_h, new_w, 3))
+                    cv2.cuda.cvtColor(gpu_big, cv2.COLOR_GRAY2BGR, dst=gpu_index)
+                    gpu_lut.transform(gpu_index, gpu_bgr)
+                    clean_frame = gpu_bgr.download(clean_buf)
+                    gray_big = None
+                elif isinstance(gray_big, cv2.UMat):
+                    # OpenCL: expand and colour on the device, then download the BGR frame once
+                    clean_frame = cv2.LUT(cv2.cvtColor(gray_big, cv2.COLOR_GRAY2BGR), palette_lut).get()
+                    gray_big = None
+                elif HAVE_NUMBA:
+                    clean_buf = ensure_buffer(clean_buf, (new_h, new_w, 3))
+                    apply_palette(gray_big, palette_lut[0], clean_buf)
+                    clean_frame = clean_buf
                 else:
-                    is_recording = False
-                    if video_writer is not None:
-                        try:
-                            video_writer.release()
-                            show_message(f"Recording stopped: {os.path.basename(video_filename)}")
-                        except Exception as e:
-                            log_exception(e, "stop recording")
-                            show_message("Failed to stop recording.")
-                        finally:
-                            video_writer = None
-            elif key in (ord('g'), ord('G')):
-                show_gradient = not show_gradient
+                    clean_buf = ensure_buffer(clean_buf, (new_h, new_w, 3))
+                    index_bgr = ensure_buffer(index_bgr, (new_h, new_w, 3))
+                    cv2.cvtColor(gray_big, cv2.COLOR_GRAY2BGR, dst=index_bgr)
+                    clean_frame = cv2.LUT(index_bgr, palette_lut, dst=clean_buf)
+
+                # --- Recording ---
+                if is_recording and video_writer is not None:
+                    video_writer.write(clean_frame)
+
+                # --- Skip rendering while the window is minimized (-1 means the backend cannot tell) ---
+                visible = cv2.getWindowProperty(WINDOW_NAME, cv2.WND_PROP_VISIBLE) != 0
+                if visible:
+                    # --- Overlay ---
+                    disp_buf = ensure_buffer(disp_buf, clean_frame.shape)
+                    np.copyto(disp_buf, clean_frame)
+                    display_frame = disp_buf
+                    h, w = display_frame.shape[:2]
+
+                    # --- Overlay gradient if enabled ---
+                    if show_gradient:
+                        grad_h = h - 2 * gradient_margin
+                        grad_resized = get_gradient_strip(map_index, grad_h)
+                        display_frame[gradient_margin:h-gradient_margin, w-gradient_width-gradient_margin:w-gradient_margin] = grad_resized
+
+                    # --- Draw static text (footer and help) ---
+                    ys, xs, colors = get_static_overlay(w, h, show_text)
+                    display_frame[ys, xs] = colors
+
+                    # --- Draw last message ---
+                    if last_message and (now - last_message_time < MESSAGE_DURATION):
+                        put_text(display_frame, last_message, (10, h - 25), FONT, FONT_SCALE, TEXT_COLOR, THICKNESS, LINE_AA)
+
+                    # --- Read the mouse value from the upscaled gray image (with defensive bounds) ---
+                    big_x = min(max(mouse_x, 0), new_w - 1)
+                    big_y = min(max(mouse_y, 0), new_h - 1)
+
+                    # Calculate grayscale value 0-100%
+                    if gray_big is not None:
+                        mouse_value = int(gray_big[big_y, big_x]) * 100 // 255
+                    else:
+                        # The upscaled gray never left the device; sample the source pixel instead
+                        orig_x = min(big_x * 100 // scale_percent, gray_uint8.shape[1] - 1)
+                        orig_y = min(big_y * 100 // scale_percent, gray_uint8.shape[0] - 1)
+                        mouse_value = int(gray_uint8[orig_y, orig_x]) * 100 // 255
+
+                    # --- Draw mouse value with outline ---
+                    draw_outlined_text(display_frame, f"{mouse_value}%", (mouse_x + 5, mouse_y - 5),
+                                       LABEL_COLOR, LABEL_OUTLINE_COLOR)
+
+                    # --- Recording indicator ---
+                    if is_recording:
+                        if now - last_blink_time >= BLINK_INTERVAL:
+                            rec_blink_state = not rec_blink_state
+                            last_blink_time = now
+                        if rec_blink_state:
+                            rec_ys, rec_xs, rec_colors = rec_overlay
+                            display_frame[rec_ys, rec_xs] = rec_colors
+
+                    # --- Show window ---
+                    cv2.imshow(WINDOW_NAME, display_frame)
+
+                # --- Keyboard controls ---
+                key = cv2.waitKey(1) & 0xFF
+                if key != 255:
+                    handler = keymap.get(key)
+                    if handler is not None and handler():
+                        break
+
+                # --- Deferred settings save ---
+                flush_settings(settings, now=now)
 
-        except Exception as e:
-            log_exception(e, "main loop iteration")
-            show_message("An unexpected error occurred.")
+            except Exception as e:
+                log_exception(e, "main loop iteration")
+                show_message("An unexpected error occurred.")
 
-except KeyboardInterrupt:
-    show_message("Interrupted by user.")
+    except KeyboardInterrupt:
+        show_message("Interrupted by user.")
 
-finally:
-    try:
-        if video_writer is not None:
-            video_writer.release()
-    except Exception as e:
-        log_exception(e, "release video_writer in finally")
-    try:
-        if stream is not None:
-            stream.release()
-    except Exception as e:
-        log_exception(e, "release camera in finally")
-    cv2.destroyAllWindows()
+    finally:
+        flush_settings(settings, force=True)
+        try:
+            grabber.stop()
+            grabber.join(timeout=2.0)
+        except Exception as e:
+            log_exception(e, "stop frame grabber in finally")
+        try:
+            if video_writer is not None:
+                video_writer.release()
+        except Exception as e:
+            log_exception(e, "release video_writer in finally")
+        try:
+            snapshot_writer.close()
+        except Exception as e:
+            log_exception(e, "close snapshot_writer in finally")
+        try:
+            if stream is not None:
+                stream.release()
+        except Exception as e:
+            log_exception(e, "release camera in finally")
+        cv2.destroyAllWindows()
+
+if __name__ == "__main__":
+    main()